@@ -0,0 +1,157 @@
+import csv
+import io
+import os
+from datetime import date
+
+from sqlalchemy import TIMESTAMP, Date, Float, Integer, String, func, select
+
+from database import SessionLocal
+from models import Consumption
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+
+EXPORT_COLUMNS = (
+    Consumption.id,
+    Consumption.charger_id,
+    Consumption.period_start,
+    Consumption.period_end,
+    Consumption.kwh_used,
+    Consumption.cost_per_kwh,
+    Consumption.total_cost,
+    Consumption.fetched_at,
+)
+
+
+def _apply_filters(statement, charger_ids: list[str] | None, date_from: date | None, date_to: date | None):
+    if charger_ids:
+        statement = statement.where(Consumption.charger_id.in_(charger_ids))
+    if date_from:
+        statement = statement.where(Consumption.period_start >= date_from)
+    if date_to:
+        statement = statement.where(Consumption.period_end <= date_to)
+    return statement
+
+
+def _stream_partitions(charger_ids, date_from, date_to):
+    """Yield batches of export rows through a server-side cursor, `EXPORT_BATCH_SIZE` rows at a time."""
+    statement = _apply_filters(select(*EXPORT_COLUMNS), charger_ids, date_from, date_to)
+    statement = statement.order_by(Consumption.charger_id, Consumption.period_start, Consumption.id)
+
+    db = SessionLocal()
+    try:
+        result = db.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        yield from result.partitions()
+    finally:
+        db.close()
+
+
+def stream_csv(charger_ids=None, date_from=None, date_to=None):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.key for column in EXPORT_COLUMNS])
+
+    for partition in _stream_partitions(charger_ids, date_from, date_to):
+        writer.writerows(partition)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands written bytes back to the caller instead of keeping them."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# Arrow type per SQLAlchemy column type of EXPORT_COLUMNS; a column of any other type fails loudly.
+_ARROW_TYPES = {
+    Integer: lambda pa: pa.int64(),
+    String: lambda pa: pa.string(),
+    Date: lambda pa: pa.date32(),
+    Float: lambda pa: pa.float64(),
+    TIMESTAMP: lambda pa: pa.timestamp("us"),
+}
+
+
+def _parquet_schema(pa):
+    return pa.schema([(column.key, _ARROW_TYPES[type(column.type)](pa)) for column in EXPORT_COLUMNS])
+
+
+def stream_parquet(charger_ids=None, date_from=None, date_to=None):
+    """Stream a Parquet file with one row group per database batch, so memory stays bounded."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema(pa)
+
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression="snappy") as writer:
+        for partition in _stream_partitions(charger_ids, date_from, date_to):
+            columns = list(zip(*partition))
+            batch = pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema
+            )
+            writer.write_table(batch, row_group_size=len(partition))
+            yield sink.drain()
+
+    yield sink.drain()
+
+
+def monthly_summary(charger_ids=None, date_from=None, date_to=None) -> list[dict]:
+    month = func.date_trunc("month", Consumption.period_start)
+    statement = _apply_filters(
+        select(
+            Consumption.charger_id,
+            month.label("month"),
+            func.count(Consumption.id).label("sessions"),
+            func.coalesce(func.sum(Consumption.kwh_used), 0).label("kwh_used"),
+            func.coalesce(func.sum(Consumption.total_cost), 0).label("total_cost"),
+        ),
+        charger_ids,
+        date_from,
+        date_to,
+    ).group_by(Consumption.charger_id, month).order_by(Consumption.charger_id, month)
+
+    db = SessionLocal()
+    try:
+        return [
+            {
+                "charger_id": row.charger_id,
+                "month": row.month.strftime("%Y-%m"),
+                "sessions": row.sessions,
+                "kwh_used": round(float(row.kwh_used), 3),
+                "total_cost": round(float(row.total_cost), 2),
+            }
+            for row in db.execute(statement)
+        ]
+    finally:
+        db.close()
@@ -1,34 +1,55 @@
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib import colors
-from reportlab.lib.styles import ParagraphStyle
-from reportlab.lib import styles
-from reportlab.lib.units import mm
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfbase import pdfmetrics
+import base64
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors, styles
 from reportlab.lib.pagesizes import A4
-from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+from reportlab.lib.units import mm
+from reportlab.platypus import Image, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
 
-from datetime import datetime
+def _logo(logo_src):
+    if not logo_src or not logo_src.startswith("data:image/") or "base64," not in logo_src:
+        return None
+    image = Image(BytesIO(base64.b64decode(logo_src.split("base64,", 1)[1])))
+    image.drawWidth, image.drawHeight = 40 * mm, 40 * mm * image.imageHeight / image.imageWidth
+    image.hAlign = "LEFT"
+    return image
+
+
+def _lines(*values):
+    return "<br/>".join(escape(str(value)) for value in values if value)
 
 
 def generate_invoice(data, filename="invoice.pdf"):
-    doc = SimpleDocTemplate(filename, pagesize=A4)
+    """Render an invoice with ReportLab from the same variables as the HTML template."""
+    # invariant=1 drops the creation date and random document ID, so identical data renders to identical bytes.
+    doc = SimpleDocTemplate(filename, pagesize=A4, title=f"Faktura {data['invoice_number']}", invariant=1)
     elements = []
 
     styles_sheet = styles.getSampleStyleSheet()
+    normal = styles_sheet["Normal"]
 
-    # ---- Title ----
+    # ---- Header ----
+    logo = _logo(data.get("logo_src"))
+    if logo:
+        elements.append(logo)
     elements.append(Paragraph("<b>Faktura</b>", styles_sheet["Title"]))
+    if data.get("company_subtitle"):
+        elements.append(Paragraph(escape(data["company_subtitle"]), normal))
     elements.append(Spacer(1, 10))
 
     # ---- Sender & Receiver ----
     sender_receiver_data = [
         ["Avsändare:", "Mottagare:"],
-        [data["sender_name"], data["receiver_name"]],
-        [data["sender_address"], data["receiver_address"]],
+        [
+            Paragraph(_lines(data["sender_name"], data["sender_address"], data["sender_postal"]), normal),
+            Paragraph(_lines(data["receiver_name"], data["receiver_address"], data["receiver_postal"]), normal),
+        ],
     ]
 
     table = Table(sender_receiver_data, colWidths=[90*mm, 90*mm])
+    table.setStyle(TableStyle([("VALIGN", (0, 0), (-1, -1), "TOP")]))
     elements.append(table)
     elements.append(Spacer(1, 10))
 
@@ -36,12 +57,14 @@ def generate_invoice(data, filename="invoice.pdf"):
     invoice_info = [
         ["Fakturadatum:", data["invoice_date"]],
         ["Fakturanr:", data["invoice_number"]],
-        ["Laddboxnr:", data["charger_number"]],
+        ["Laddboxnr:", data["laddbox_number"]],
         ["Förfallodatum:", data["due_date"]],
     ]
 
-    table = Table(invoice_info, colWidths=[50*mm, 50*mm])
+    table = Table(invoice_info, colWidths=[50*mm, 90*mm])
     elements.append(table)
+    elements.append(Spacer(1, 10))
+    elements.append(Paragraph(escape(data["message"]), normal))
     elements.append(Spacer(1, 15))
 
     # ---- Specification Table ----
@@ -49,16 +72,24 @@ def generate_invoice(data, filename="invoice.pdf"):
         ["Specifikation", "Antal kWh", "Mätperiod", "Schablonpris/kWh", "Total kr"]
     ]
 
-    for row in data["rows"]:
+    for index, row in enumerate(data["charging_items"]):
         spec_data.append([
-            row["description"],
+            data["charging_label"] if index == 0 else "",
             row["kwh"],
             row["period"],
-            f'{row["price_per_kwh"]} kr',
-            f'{row["total"]} kr'
+            row["price_per_kwh"],
+            row["total"],
         ])
 
-    table = Table(spec_data, colWidths=[35*mm, 25*mm, 30*mm, 35*mm, 30*mm])
+    spec_data.append([
+        data["admin_label"],
+        data["admin_quantity"],
+        data["admin_period"],
+        data["admin_price"],
+        data["admin_total"],
+    ])
+
+    table = Table(spec_data, colWidths=[35*mm, 25*mm, 45*mm, 35*mm, 30*mm], repeatRows=1)
     table.setStyle(TableStyle([
         ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
         ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
@@ -70,9 +101,9 @@ def generate_invoice(data, filename="invoice.pdf"):
 
     # ---- Totals ----
     totals_data = [
-        ["Summa faktura:", f'{data["total_invoice"]} kr'],
-        ["Öresutjämning:", f'{data["rounding"]} kr'],
-        ["Summa att betala:", f'{data["total_to_pay"]} kr'],
+        ["Summa faktura:", data["subtotal"]],
+        ["Öresutjämning:", data["rounding"]],
+        ["Summa att betala:", data["total_to_pay"]],
     ]
 
     table = Table(totals_data, colWidths=[70*mm, 30*mm])
@@ -87,36 +118,16 @@ def generate_invoice(data, filename="invoice.pdf"):
     elements.append(Paragraph("<b>Betalningsuppgifter</b>", styles_sheet["Heading2"]))
     elements.append(Spacer(1, 5))
     elements.append(Paragraph(
-        f"Var vänlig ange referensnumret {data['reference_number']} vid betalning.",
-        styles_sheet["Normal"]
+        f"Var vänlig ange referensnumret {escape(str(data['reference_number']))} vid betalning.",
+        normal
+    ))
+    elements.append(Paragraph(f"Plusgiro: {escape(data['plusgiro'])} &nbsp; Bankgiro: {escape(data['bankgiro'])}", normal))
+    elements.append(Paragraph(f"Org.nr: {escape(data['org_number'])}", normal))
+    elements.append(Spacer(1, 10))
+    elements.append(Paragraph(
+        _lines(data["contact_name"], data["contact_phone"], data["contact_email"]),
+        normal
     ))
 
     doc.build(elements)
-
-
-# -------------------------
-# Example usage
-# -------------------------
-
-invoice_data = {
-    "sender_name": "Samfälligheten Skogsbrynet Västra",
-    "sender_address": "Nils Kaggs gata 7C\n254 54 Helsingborg",
-    "receiver_name": "Robert Nehez",
-    "receiver_address": "CBV 12E\n254 54 Helsingborg",
-    "invoice_date": "2026-02-11",
-    "invoice_number": "52",
-    "charger_number": "ZPG014932 60996",
-    "due_date": "2026-02-28",
-    "rows": [
-        {"description": "", "kwh": "77,76", "period": "Nov-2025", "price_per_kwh": "2,00", "total": "155,52"},
-        {"description": "", "kwh": "84,16", "period": "Dec-2025", "price_per_kwh": "2,00", "total": "168,31"},
-        {"description": "", "kwh": "85,73", "period": "Jan-2026", "price_per_kwh": "2,00", "total": "171,46"},
-        {"description": "Administrationsavgift", "kwh": "3 Per månad", "period": "", "price_per_kwh": "15,00", "total": "45,00"},
-    ],
-    "total_invoice": "540,30",
-    "rounding": "-0,30",
-    "total_to_pay": "540,00",
-    "reference_number": "60996",
-}
-
-generate_invoice(invoice_data, "generated_invoice.pdf")
\ No newline at end of file
+    return filename
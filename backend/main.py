@@ -1,25 +1,49 @@
+import hashlib
 import os
+import tempfile
+import threading
+import time
 import uuid
+from contextlib import asynccontextmanager
 from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
 from urllib.parse import quote
 
 import requests
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
 from pydantic import BaseModel, Field
+from sqlalchemy import func, inspect, or_, text
 
+from consumption_export import monthly_summary, parquet_available, stream_csv, stream_parquet
 from database import SessionLocal, engine
-from models import Base, Consumption, Invoice, Owner
-from pdf_generator import generate_invoice_pdf
+from models import Base, Consumption, DataVersion, Invoice, Owner
+from pdf_generator import DEFAULT_PDF_ENGINE, PDF_ENGINES, generate_invoice_pdf
+from pdf_store import PdfStore, is_content_name, is_valid_name
+from scheduler import SyncScheduler
 from zaptec_api import authenticate_user, fetch_charge_history, fetch_chargers
 
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
 BASE_DIR = Path(__file__).resolve().parent
 GENERATED_DIR = BASE_DIR / "generated"
 GENERATED_DIR.mkdir(exist_ok=True)
+pdf_store = PdfStore(GENERATED_DIR)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    scheduler.start()
+    yield
+    scheduler.stop()
+
 
-app = FastAPI(title="Zaptec Invoice API")
+app = FastAPI(title="Zaptec Invoice API", lifespan=lifespan)
 
 default_origins = "https://zaptec-invoice-app.vercel.app,http://localhost:5173,http://127.0.0.1:5173"
 cors_origins = [origin.strip() for origin in os.getenv("CORS_ORIGINS", default_origins).split(",") if origin.strip()]
@@ -32,10 +56,41 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.mount("/files", StaticFiles(directory=GENERATED_DIR), name="files")
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1000"))
+
+# PDFs and Parquet are already compressed, and brotli-asgi would also compress 206 range responses.
+# brotli-asgi only excludes by path, so Parquet exports have their own route; CSV exports stay compressed.
+COMPRESSION_EXCLUDED_PATHS = [r"^/files/", r"^/consumptions/export/parquet$"]
+COMPRESSION_EXCLUDED_CONTENT_TYPES = ("application/pdf", "application/vnd.apache.parquet")
+
+if BrotliMiddleware is not None:
+    app.add_middleware(
+        BrotliMiddleware,
+        minimum_size=COMPRESSION_MIN_SIZE,
+        gzip_fallback=True,
+        excluded_handlers=COMPRESSION_EXCLUDED_PATHS,
+    )
+else:
+    app.add_middleware(
+        GZipMiddleware,
+        minimum_size=COMPRESSION_MIN_SIZE,
+        exclude_content_types=COMPRESSION_EXCLUDED_CONTENT_TYPES,
+    )
+
 Base.metadata.create_all(bind=engine)
 
 
+def _add_missing_invoice_columns() -> None:
+    # create_all() does not alter tables that already exist, so add columns introduced later here.
+    existing_columns = {column["name"] for column in inspect(engine).get_columns("invoices")}
+    if "pdf_engine" not in existing_columns:
+        with engine.begin() as connection:
+            connection.execute(text("ALTER TABLE invoices ADD COLUMN pdf_engine VARCHAR"))
+
+
+_add_missing_invoice_columns()
+
+
 class LoginRequest(BaseModel):
     username: str = Field(min_length=3)
     password: str = Field(min_length=3)
@@ -112,6 +167,16 @@ def _upload_invoice_to_supabase(file_path: Path, object_name: str) -> str:
     return f"supabase://{SUPABASE_BUCKET}/{object_name}"
 
 
+def _download_invoice_from_supabase(bucket: str, object_name: str, target_path: Path) -> bool:
+    download_url = f"{SUPABASE_URL}/storage/v1/object/{quote(bucket)}/{quote(object_name)}"
+    response = requests.get(download_url, headers=_supabase_headers(), timeout=30)
+    if response.status_code != 200:
+        return False
+
+    target_path.write_bytes(response.content)
+    return True
+
+
 def _create_signed_invoice_url(bucket: str, object_name: str) -> str:
     sign_url = f"{SUPABASE_URL}/storage/v1/object/sign/{quote(bucket)}/{quote(object_name)}"
     response = requests.post(
@@ -148,6 +213,41 @@ def _resolve_invoice_pdf_url(stored_url: str | None) -> str | None:
 
     return stored_url
 
+DATA_VERSION_NAME = "invoices"
+
+
+def _bump_data_version(db) -> None:
+    """Increment the persisted data version inside the caller's transaction."""
+    updated = (
+        db.query(DataVersion)
+        .filter(DataVersion.name == DATA_VERSION_NAME)
+        .update({DataVersion.version: DataVersion.version + 1}, synchronize_session=False)
+    )
+    if not updated:
+        db.add(DataVersion(name=DATA_VERSION_NAME, version=1))
+
+
+def _invoices_etag(db) -> str:
+    # Everything in the marker is read from the database, so all workers and restarts agree on it.
+    version = db.query(DataVersion.version).filter(DataVersion.name == DATA_VERSION_NAME).scalar() or 0
+    invoice_count, latest_generated_at = db.query(func.count(Invoice.invoice_id), func.max(Invoice.generated_at)).one()
+
+    # Signed Supabase URLs expire, so a cached list must be rebuilt well before that happens.
+    signed_url_window = int(time.time() // max(SIGNED_URL_TTL_SECONDS // 2, 1)) if _supabase_enabled() else 0
+
+    marker = f"{version}:{invoice_count}:{latest_generated_at}:{signed_url_window}"
+    # Weak, because the same validator is sent for identity, gzip and br encodings of the body.
+    return 'W/"' + hashlib.sha256(marker.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    # If-None-Match uses weak comparison, so a W/ prefix on either side is ignored.
+    if not if_none_match:
+        return False
+    candidates = {value.strip().removeprefix("W/") for value in if_none_match.split(",")}
+    return "*" in candidates or etag.removeprefix("W/") in candidates
+
+
 def _extract_kwh(entry):
     if entry.get("KWh") is not None:
         return float(entry["KWh"])
@@ -176,6 +276,83 @@ def login(payload: LoginRequest):
         raise HTTPException(status_code=401, detail=f"Zaptec login failed: {exc}") from exc
 
 
+# Serializes manual and scheduled syncs: _sync_charger checks for existing rows before inserting,
+# so two overlapping syncs of the same charger would otherwise insert duplicates.
+_sync_lock = threading.Lock()
+
+
+def _sync_charger(db, access_token: str, charger: dict, history_from: datetime) -> tuple[int, int]:
+    charger_id = str(charger.get("Id") or charger.get("id") or "")
+    if not charger_id:
+        return 0, 0
+
+    inserted_count = 0
+    owners_created = 0
+
+    existing_owner = db.query(Owner).filter(Owner.charger_id == charger_id).first()
+    if not existing_owner:
+        owner = Owner(
+            owner_id=charger_id,
+            name=charger.get("Name") or f"Charger {charger_id}",
+            address=charger.get("Address") or "",
+            phone="",
+            charger_id=charger_id,
+            last_month_used=date.today(),
+        )
+        db.add(owner)
+        owners_created += 1
+
+    history_entries = fetch_charge_history(access_token, charger_id, start_time=history_from)
+    for entry in history_entries:
+        start, end = _extract_session_bounds(entry)
+        if not start or not end:
+            continue
+
+        existing = (
+            db.query(Consumption)
+            .filter(
+                Consumption.charger_id == charger_id,
+                Consumption.period_start == start.date(),
+                Consumption.period_end == end.date(),
+            )
+            .first()
+        )
+        if existing:
+            continue
+
+        kwh_used = _extract_kwh(entry)
+        cost_per_kwh = float(os.getenv("COST_PER_KWH", 0.25))
+        consumption = Consumption(
+            charger_id=charger_id,
+            period_start=start.date(),
+            period_end=end.date(),
+            kwh_used=kwh_used,
+            cost_per_kwh=cost_per_kwh,
+            total_cost=kwh_used * cost_per_kwh,
+            fetched_at=datetime.utcnow(),
+        )
+        db.add(consumption)
+        inserted_count += 1
+
+    return inserted_count, owners_created
+
+
+def _sync_scheduled_charger(access_token: str, charger: dict, history_from: datetime) -> tuple[int, int]:
+    db = SessionLocal()
+    try:
+        with _sync_lock:
+            inserted_count, owners_created = _sync_charger(db, access_token, charger, history_from)
+            if inserted_count or owners_created:
+                _bump_data_version(db)
+            db.commit()
+        return inserted_count, owners_created
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
 @app.post("/sync")
 def sync_data(payload: SyncRequest):
     db = SessionLocal()
@@ -189,57 +366,15 @@ def sync_data(payload: SyncRequest):
 
         history_from = datetime.now(timezone.utc) - timedelta(days=payload.history_days)
 
-        for charger in chargers:
-            charger_id = str(charger.get("Id") or charger.get("id") or "")
-            if not charger_id:
-                continue
-
-            existing_owner = db.query(Owner).filter(Owner.charger_id == charger_id).first()
-            if not existing_owner:
-                owner = Owner(
-                    owner_id=charger_id,
-                    name=charger.get("Name") or f"Charger {charger_id}",
-                    address=charger.get("Address") or "",
-                    phone="",
-                    charger_id=charger_id,
-                    last_month_used=date.today(),
-                )
-                db.add(owner)
-                owners_created += 1
-
-            history_entries = fetch_charge_history(payload.access_token, charger_id, start_time=history_from)
-            for entry in history_entries:
-                start, end = _extract_session_bounds(entry)
-                if not start or not end:
-                    continue
-
-                existing = (
-                    db.query(Consumption)
-                    .filter(
-                        Consumption.charger_id == charger_id,
-                        Consumption.period_start == start.date(),
-                        Consumption.period_end == end.date(),
-                    )
-                    .first()
-                )
-                if existing:
-                    continue
-
-                kwh_used = _extract_kwh(entry)
-                cost_per_kwh = float(os.getenv("COST_PER_KWH", 0.25))
-                consumption = Consumption(
-                    charger_id=charger_id,
-                    period_start=start.date(),
-                    period_end=end.date(),
-                    kwh_used=kwh_used,
-                    cost_per_kwh=cost_per_kwh,
-                    total_cost=kwh_used * cost_per_kwh,
-                    fetched_at=datetime.utcnow(),
-                )
-                db.add(consumption)
-                inserted_count += 1
-
-        db.commit()
+        with _sync_lock:
+            for charger in chargers:
+                charger_inserted, charger_owners_created = _sync_charger(db, payload.access_token, charger, history_from)
+                inserted_count += charger_inserted
+                owners_created += charger_owners_created
+
+            if inserted_count or owners_created:
+                _bump_data_version(db)
+            db.commit()
         return {
             "message": "Zaptec chargers and charge history synchronized.",
             "inserted": inserted_count,
@@ -254,63 +389,231 @@ def sync_data(payload: SyncRequest):
         db.close()
 
 
+def _billable_consumptions(db, charger_id: str, period_start: date, period_end: date, fetched_before: datetime) -> list:
+    # Limiting to rows fetched before the invoice was generated lets an evicted PDF be re-rendered
+    # with exactly the line items it was issued with, even after later syncs.
+    return (
+        db.query(Consumption)
+        .filter(
+            Consumption.charger_id == charger_id,
+            Consumption.period_start >= period_start,
+            Consumption.period_end <= period_end,
+            Consumption.fetched_at <= fetched_before,
+        )
+        .order_by(Consumption.period_start.asc())
+        .all()
+    )
+
+
+def _render_invoice_pdf(
+    owner, consumptions, total_amount, invoice_id, period_start, period_end, pdf_engine, invoice_date
+) -> str:
+    # The renderer uses the file stem as invoice number, so render under the invoice id and
+    # let the store rename it to its content hash.
+    with tempfile.TemporaryDirectory(dir=GENERATED_DIR) as render_dir:
+        pdf_path = Path(render_dir) / f"{invoice_id}.pdf"
+        generate_invoice_pdf(
+            owner,
+            consumptions,
+            total_amount,
+            str(pdf_path),
+            period_start,
+            period_end,
+            engine=pdf_engine,
+            invoice_date=invoice_date,
+        )
+        return pdf_store.put(pdf_path)
+
+
+def _restore_invoice_pdf(file_name: str) -> str | None:
+    """Bring an evicted PDF back into the store, from Supabase if possible, otherwise by re-rendering it.
+
+    The re-render reuses the inputs of the original run (invoice date, engine and the consumptions known
+    at `generated_at`), so deterministic engines reproduce the same file and content hash.
+    """
+    db = SessionLocal()
+    try:
+        invoice = (
+            db.query(Invoice)
+            .filter(or_(Invoice.pdf_url == f"/files/{file_name}", Invoice.pdf_url.like(f"supabase://%/{file_name}")))
+            .first()
+        )
+        if not invoice:
+            return None
+
+        if invoice.pdf_url.startswith("supabase://") and _supabase_enabled():
+            bucket, _, object_name = invoice.pdf_url.replace("supabase://", "", 1).partition("/")
+            with tempfile.TemporaryDirectory(dir=GENERATED_DIR) as download_dir:
+                download_path = Path(download_dir) / object_name
+                if _download_invoice_from_supabase(bucket, object_name, download_path):
+                    return pdf_store.put(download_path)
+
+        owner = db.query(Owner).filter(Owner.owner_id == invoice.owner_id).first()
+        if not owner:
+            return None
+
+        consumptions = _billable_consumptions(
+            db, owner.charger_id, invoice.period_start, invoice.period_end, invoice.generated_at
+        )
+        restored_name = _render_invoice_pdf(
+            owner,
+            consumptions,
+            invoice.total_amount,
+            invoice.invoice_id,
+            invoice.period_start,
+            invoice.period_end,
+            # Invoices from before engines were selectable were all rendered by WeasyPrint.
+            invoice.pdf_engine or "weasyprint",
+            invoice.generated_at.date(),
+        )
+        if restored_name != file_name:
+            invoice.pdf_url = _upload_invoice_to_supabase(pdf_store.path(restored_name), restored_name)
+            _bump_data_version(db)
+            db.commit()
+        return restored_name
+    finally:
+        db.close()
+
+
+class _StoredPdfResponse(FileResponse):
+    def __init__(self, *args, on_complete=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._on_complete = on_complete
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self._on_complete:
+                self._on_complete()
+
+    def set_stat_headers(self, stat_result):
+        # Keep the content-hash ETag instead of Starlette's mtime/size one.
+        etag = self.headers.get("etag")
+        super().set_stat_headers(stat_result)
+        if etag:
+            self.headers["etag"] = etag
+
+
+@app.get("/files/{file_name}")
+def get_invoice_file(file_name: str, request: Request):
+    if not is_valid_name(file_name):
+        raise HTTPException(status_code=404, detail="Invoice PDF not found")
+
+    headers = {"Accept-Ranges": "bytes"}
+    if is_content_name(file_name):
+        etag = f'"{file_name.removesuffix(".pdf")}"'
+        headers.update({"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"})
+        # Content-hash names never change content, so revalidation needs no file, even if it was evicted.
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+    else:
+        headers["Cache-Control"] = "no-cache"
+
+    path = pdf_store.pin(file_name)
+    if path is None:
+        restored_name = _restore_invoice_pdf(file_name)
+        if not restored_name:
+            raise HTTPException(status_code=404, detail="Invoice PDF not found")
+        if restored_name != file_name:
+            return RedirectResponse(f"/files/{restored_name}", status_code=307)
+        path = pdf_store.pin(file_name)
+        if path is None:
+            raise HTTPException(status_code=503, detail="Invoice PDF was evicted while being restored, please retry")
+
+    # Pinned until the response is sent, so a concurrent put() cannot evict the file mid-response.
+    return _StoredPdfResponse(
+        path,
+        media_type="application/pdf",
+        headers=headers,
+        on_complete=lambda: pdf_store.release(file_name),
+    )
+
+
 @app.post("/generate-invoices")
-def generate_invoices(target_month: str | None = Query(default=None, description="YYYY-MM")):
+def generate_invoices(
+    target_month: str | None = Query(default=None, description="YYYY-MM"),
+    pdf_engine: str | None = Query(default=None, alias="engine", description=f"PDF engine: {', '.join(PDF_ENGINES)}"),
+):
+    pdf_engine = pdf_engine or DEFAULT_PDF_ENGINE
+    if pdf_engine not in PDF_ENGINES:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown PDF engine '{pdf_engine}', expected one of: {', '.join(PDF_ENGINES)}"
+        )
+
     db = SessionLocal()
     period_start, period_end = _get_billing_period(target_month)
 
-    try:
-        owners = db.query(Owner).all()
-        created = []
-
-        for owner in owners:
-            consumptions = (
-                db.query(Consumption)
-                .filter(
-                    Consumption.charger_id == owner.charger_id,
-                    Consumption.period_start >= period_start,
-                    Consumption.period_end <= period_end,
-                )
-                .order_by(Consumption.period_start.asc())
-                .all()
-            )
+    # Holding the sync lock means no sync can commit rows fetched before generated_at after the query below,
+    # so `fetched_at <= generated_at` identifies exactly the consumptions billed on these invoices.
+    with _sync_lock:
+        try:
+            return _generate_invoices(db, period_start, period_end, pdf_engine)
+        finally:
+            db.close()
 
-            if not consumptions:
-                continue
-
-            total_amount = sum(item.total_cost for item in consumptions)
-            invoice_id = str(uuid.uuid4())
-            pdf_path = GENERATED_DIR / f"{invoice_id}.pdf"
-            generate_invoice_pdf(owner, consumptions, total_amount, str(pdf_path), period_start, period_end)
-
-            object_name = f"{invoice_id}.pdf"
-            stored_pdf_url = _upload_invoice_to_supabase(pdf_path, object_name)
-
-            invoice = Invoice(
-                invoice_id=invoice_id,
-                owner_id=owner.owner_id,
-                period_start=period_start,
-                period_end=period_end,
-                total_amount=total_amount,
-                pdf_url=stored_pdf_url,
-                generated_at=datetime.utcnow(),
-            )
-            db.add(invoice)
-            created.append(invoice_id)
 
-        db.commit()
-        return {
-            "message": f"Generated {len(created)} invoice(s) for {period_start.strftime('%Y-%m')}",
-            "invoice_ids": created,
-        }
-    finally:
-        db.close()
+def _generate_invoices(db, period_start: date, period_end: date, pdf_engine: str) -> dict:
+    generated_at = datetime.utcnow()
+    owners = db.query(Owner).all()
+    created = []
+
+    for owner in owners:
+        consumptions = _billable_consumptions(db, owner.charger_id, period_start, period_end, generated_at)
+
+        if not consumptions:
+            continue
+
+        total_amount = sum(item.total_cost for item in consumptions)
+        invoice_id = str(uuid.uuid4())
+        file_name = _render_invoice_pdf(
+            owner, consumptions, total_amount, invoice_id, period_start, period_end, pdf_engine, generated_at.date()
+        )
+        stored_pdf_url = _upload_invoice_to_supabase(pdf_store.path(file_name), file_name)
+
+        invoice = Invoice(
+            invoice_id=invoice_id,
+            owner_id=owner.owner_id,
+            period_start=period_start,
+            period_end=period_end,
+            total_amount=total_amount,
+            pdf_url=stored_pdf_url,
+            pdf_engine=pdf_engine,
+            generated_at=generated_at,
+        )
+        db.add(invoice)
+        created.append(invoice_id)
+
+    _bump_data_version(db)
+    db.commit()
+    return {
+        "message": f"Generated {len(created)} invoice(s) for {period_start.strftime('%Y-%m')}",
+        "engine": pdf_engine,
+        "invoice_ids": created,
+    }
+
+
+scheduler = SyncScheduler(
+    sync_charger=_sync_scheduled_charger,
+    generate_invoices=lambda target_month: generate_invoices(target_month=target_month, pdf_engine=None),
+)
+
+
+@app.get("/schedule")
+def schedule_state():
+    return scheduler.state()
 
 
 @app.get("/invoices")
-def list_invoices():
+def list_invoices(request: Request, response: Response):
     db = SessionLocal()
     try:
+        etag = _invoices_etag(db)
+        cache_headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=cache_headers)
+
+        response.headers.update(cache_headers)
         invoices = db.query(Invoice).order_by(Invoice.generated_at.desc()).all()
         result = []
         for invoice in invoices:
@@ -328,3 +631,42 @@ def list_invoices():
         return result
     finally:
         db.close()
+
+
+@app.get("/consumptions/export")
+def export_consumptions(
+    request: Request,
+    export_format: str = Query(default="csv", alias="format", pattern="^(csv|parquet)$"),
+    charger_id: list[str] | None = Query(default=None),
+    date_from: date | None = Query(default=None, description="YYYY-MM-DD, inclusive"),
+    date_to: date | None = Query(default=None, description="YYYY-MM-DD, inclusive"),
+):
+    if export_format == "parquet":
+        query = request.url.remove_query_params("format").query
+        return RedirectResponse(f"/consumptions/export/parquet{'?' + query if query else ''}", status_code=307)
+
+    headers = {"Content-Disposition": 'attachment; filename="consumptions.csv"'}
+    return StreamingResponse(stream_csv(charger_id, date_from, date_to), media_type="text/csv", headers=headers)
+
+
+@app.get("/consumptions/export/parquet")
+def export_consumptions_parquet(
+    charger_id: list[str] | None = Query(default=None),
+    date_from: date | None = Query(default=None, description="YYYY-MM-DD, inclusive"),
+    date_to: date | None = Query(default=None, description="YYYY-MM-DD, inclusive"),
+):
+    if not parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow to be installed.")
+    headers = {"Content-Disposition": 'attachment; filename="consumptions.parquet"'}
+    return StreamingResponse(
+        stream_parquet(charger_id, date_from, date_to), media_type="application/vnd.apache.parquet", headers=headers
+    )
+
+
+@app.get("/consumptions/summary")
+def consumption_summary(
+    charger_id: list[str] | None = Query(default=None),
+    date_from: date | None = Query(default=None, description="YYYY-MM-DD, inclusive"),
+    date_to: date | None = Query(default=None, description="YYYY-MM-DD, inclusive"),
+):
+    return monthly_summary(charger_id, date_from, date_to)
@@ -31,4 +31,10 @@ class Invoice(Base):
     period_end = Column(Date)
     total_amount = Column(Float)
     pdf_url = Column(String)
+    pdf_engine = Column(String)
     generated_at = Column(TIMESTAMP)
+
+class DataVersion(Base):
+    __tablename__ = "data_versions"
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
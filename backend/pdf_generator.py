@@ -1,13 +1,19 @@
 import json
+import os
 from datetime import date, timedelta
+from functools import lru_cache
 from pathlib import Path
+from typing import Callable
 
 from jinja2 import Template
-from weasyprint import HTML
 
 BASE_DIR = Path(__file__).resolve().parent
 TEMPLATE_PATH = BASE_DIR / "skogsbrynet_invoice_template.html"
 VARIABLES_PATH = BASE_DIR / "skogsbrynet_invoice_template_variables.json"
+DEFAULT_PDF_ENGINE = os.getenv("PDF_ENGINE", "weasyprint")
+
+# A renderer writes one invoice PDF from the template variables built by `build_invoice_variables`.
+PdfRenderer = Callable[[dict, str], None]
 
 
 def _format_number(value: float) -> str:
@@ -40,9 +46,20 @@ def _build_charging_items(consumptions: list) -> list[dict[str, str]]:
     return items
 
 
-def generate_invoice_pdf(owner, consumptions, total_amount, output_path, period_start, period_end):
-    template = Template(TEMPLATE_PATH.read_text(encoding="utf-8"))
-    variables = json.loads(VARIABLES_PATH.read_text(encoding="utf-8"))
+@lru_cache(maxsize=1)
+def _load_template() -> Template:
+    return Template(TEMPLATE_PATH.read_text(encoding="utf-8"))
+
+
+@lru_cache(maxsize=1)
+def _load_default_variables() -> str:
+    return VARIABLES_PATH.read_text(encoding="utf-8")
+
+
+def build_invoice_variables(
+    owner, consumptions, total_amount, invoice_number, period_start, period_end, invoice_date=None
+) -> dict:
+    variables = json.loads(_load_default_variables())
 
     charging_items = _build_charging_items(consumptions)
     due_date = period_end + timedelta(days=14)
@@ -53,7 +70,7 @@ def generate_invoice_pdf(owner, consumptions, total_amount, output_path, period_
 
     variables.update(
         {
-            "invoice_date": _format_date(date.today()),
+            "invoice_date": _format_date(invoice_date or date.today()),
             "receiver_name": owner.name,
             "receiver_address": receiver_address,
             "receiver_postal": receiver_postal,
@@ -67,12 +84,40 @@ def generate_invoice_pdf(owner, consumptions, total_amount, output_path, period_
             "charging_items": charging_items,
             "charging_items_count": len(charging_items),
             "charging_label": "Laddning",
+            "invoice_number": invoice_number,
         }
     )
+    return variables
+
 
-    output_file = Path(output_path)
-    variables["invoice_number"] = output_file.stem
+def _render_weasyprint(variables: dict, output_path: str) -> None:
+    from weasyprint import HTML
 
-    rendered_html = template.render(**variables)
+    rendered_html = _load_template().render(**variables)
     HTML(string=rendered_html, base_url=str(BASE_DIR)).write_pdf(output_path)
+
+
+def _render_reportlab(variables: dict, output_path: str) -> None:
+    from invoice_pdf import generate_invoice
+
+    generate_invoice(variables, output_path)
+
+
+PDF_ENGINES: dict[str, PdfRenderer] = {
+    "weasyprint": _render_weasyprint,
+    "reportlab": _render_reportlab,
+}
+
+
+def generate_invoice_pdf(
+    owner, consumptions, total_amount, output_path, period_start, period_end, engine=None, invoice_date=None
+):
+    engine = engine or DEFAULT_PDF_ENGINE
+    if engine not in PDF_ENGINES:
+        raise ValueError(f"Unknown PDF engine '{engine}', expected one of: {', '.join(PDF_ENGINES)}")
+
+    variables = build_invoice_variables(
+        owner, consumptions, total_amount, Path(output_path).stem, period_start, period_end, invoice_date
+    )
+    PDF_ENGINES[engine](variables, output_path)
     return output_path
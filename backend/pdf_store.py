@@ -0,0 +1,116 @@
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+PDF_STORE_MAX_BYTES = int(os.getenv("PDF_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+_CONTENT_NAME = re.compile(r"^[0-9a-f]{64}\.pdf$")
+_FILE_NAME = re.compile(r"^[\w-]+\.pdf$")
+
+
+def is_content_name(file_name: str) -> bool:
+    return bool(_CONTENT_NAME.match(file_name))
+
+
+def is_valid_name(file_name: str) -> bool:
+    return bool(_FILE_NAME.match(file_name))
+
+
+def _sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as source:
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PdfStore:
+    """Local PDF cache named by SHA-256 of the content and bounded to `max_bytes` with LRU eviction.
+
+    Recency is kept in memory and mirrored to each file's atime, so the order survives restarts.
+    PDFs written before the store existed (named `<invoice_id>.pdf`) are tracked and evicted the same way.
+    Entries pinned with `pin()` are never evicted until they are released, so a file being served stays on disk.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = PDF_STORE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._pins: dict[str, int] = {}
+        self._total_bytes = 0
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        files = sorted(self.directory.glob("*.pdf"), key=lambda path: path.stat().st_atime)
+        for path in files:
+            size = path.stat().st_size
+            self._entries[path.name] = size
+            self._total_bytes += size
+
+        with self._lock:
+            self._evict_locked()
+
+    def path(self, file_name: str) -> Path:
+        return self.directory / file_name
+
+    def put(self, source: Path) -> str:
+        """Move `source` into the store and return its content-addressed file name."""
+        file_name = f"{_sha256_file(source)}.pdf"
+        target = self.path(file_name)
+
+        with self._lock:
+            if file_name in self._entries and target.exists():
+                source.unlink()
+            else:
+                shutil.move(str(source), target)
+                size = target.stat().st_size
+                self._total_bytes += size - self._entries.get(file_name, 0)
+                self._entries[file_name] = size
+            self._touch_locked(file_name)
+            self._evict_locked(keep=file_name)
+
+        return file_name
+
+    def pin(self, file_name: str) -> Path | None:
+        """Return the path of a stored PDF and protect it from eviction until `release()`."""
+        with self._lock:
+            if file_name not in self._entries:
+                return None
+            if not self.path(file_name).exists():
+                self._total_bytes -= self._entries.pop(file_name)
+                return None
+            self._touch_locked(file_name)
+            self._pins[file_name] = self._pins.get(file_name, 0) + 1
+        return self.path(file_name)
+
+    def release(self, file_name: str):
+        with self._lock:
+            remaining = self._pins.get(file_name, 0) - 1
+            if remaining > 0:
+                self._pins[file_name] = remaining
+            else:
+                self._pins.pop(file_name, None)
+            self._evict_locked()
+
+    def _touch_locked(self, file_name: str):
+        self._entries.move_to_end(file_name)
+        path = self.path(file_name)
+        try:
+            os.utime(path, (time.time(), path.stat().st_mtime))
+        except OSError:
+            pass
+
+    def _evict_locked(self, keep: str | None = None):
+        # Oldest first; the entry just stored and pinned entries stay even if that leaves the store over budget.
+        for file_name in list(self._entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if file_name == keep or file_name in self._pins:
+                continue
+            self._total_bytes -= self._entries.pop(file_name)
+            self.path(file_name).unlink(missing_ok=True)
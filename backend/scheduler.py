@@ -0,0 +1,258 @@
+import logging
+import os
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+
+from database import SessionLocal
+from models import Invoice
+from zaptec_api import REQUESTS_PER_MINUTE, authenticate_user, fetch_chargers
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "false").lower() in {"1", "true", "yes"}
+SYNC_INTERVAL_MINUTES = float(os.getenv("SCHEDULER_SYNC_INTERVAL_MINUTES", "60"))
+SYNC_JITTER_SECONDS = float(os.getenv("SCHEDULER_SYNC_JITTER_SECONDS", "120"))
+SYNC_HISTORY_DAYS = int(os.getenv("SCHEDULER_HISTORY_DAYS", "7"))
+AUTO_INVOICE = os.getenv("SCHEDULER_AUTO_INVOICE", "true").lower() in {"1", "true", "yes"}
+INVOICE_GRACE_HOURS = float(os.getenv("SCHEDULER_INVOICE_GRACE_HOURS", "6"))
+ZAPTEC_USERNAME = os.getenv("ZAPTEC_USERNAME", "")
+ZAPTEC_PASSWORD = os.getenv("ZAPTEC_PASSWORD", "")
+
+
+def _previous_month_start(today: date) -> date:
+    return (today.replace(day=1) - timedelta(days=1)).replace(day=1)
+
+
+def _month_start(day: date) -> datetime:
+    return datetime.combine(day.replace(day=1), datetime.min.time(), tzinfo=timezone.utc)
+
+
+def _charger_id(charger: dict) -> str:
+    return str(charger.get("Id") or charger.get("id") or "")
+
+
+def _month_invoiced(period_start: date) -> bool:
+    db = SessionLocal()
+    try:
+        return db.query(Invoice.invoice_id).filter(Invoice.period_start == period_start).first() is not None
+    finally:
+        db.close()
+
+
+class SyncScheduler:
+    """Runs periodic syncs in a background thread, spreading chargers evenly over the sync interval.
+
+    `sync_charger(access_token, charger, history_from)` persists one charger and returns
+    `(inserted, owners_created)`; `generate_invoices(target_month)` runs the monthly invoice job.
+    """
+
+    def __init__(self, sync_charger, generate_invoices):
+        self._sync_charger = sync_charger
+        self._generate_invoices = generate_invoices
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._token = None
+        self._token_expires_at = 0.0
+        # Per charger id, the unbroken span `(covered_from, covered_until)` of charge history that this
+        # scheduler has fetched successfully since it started; used for month-end completeness.
+        self._charger_coverage: dict[str, tuple[datetime, datetime]] = {}
+        self._state = {
+            "enabled": SCHEDULER_ENABLED,
+            "running": False,
+            "interval_minutes": SYNC_INTERVAL_MINUTES,
+            "jitter_seconds": SYNC_JITTER_SECONDS,
+            "history_days": SYNC_HISTORY_DAYS,
+            "requests_per_minute": REQUESTS_PER_MINUTE,
+            "auto_invoice": AUTO_INVOICE,
+            "current_cycle_started_at": None,
+            "chargers_total": 0,
+            "chargers_synced": 0,
+            "next_charger_at": None,
+            "last_cycle_started_at": None,
+            "last_cycle_finished_at": None,
+            "last_cycle_inserted": 0,
+            "last_cycle_owners_created": 0,
+            "failed_chargers": [],
+            "last_error": None,
+            "next_cycle_at": None,
+            "last_invoiced_month": None,
+            "month_end_waiting_for": [],
+        }
+
+    def state(self) -> dict:
+        with self._lock:
+            return dict(self._state)
+
+    def _update(self, **values):
+        with self._lock:
+            self._state.update(values)
+
+    def start(self):
+        if not SCHEDULER_ENABLED:
+            return
+        if not (ZAPTEC_USERNAME and ZAPTEC_PASSWORD):
+            self._update(last_error="ZAPTEC_USERNAME and ZAPTEC_PASSWORD must be set to run scheduled syncs.")
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sync-scheduler", daemon=True)
+        self._thread.start()
+        self._update(running=True)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        self._update(running=False)
+
+    def _access_token(self) -> str:
+        if not self._token or time.monotonic() >= self._token_expires_at:
+            token = authenticate_user(ZAPTEC_USERNAME, ZAPTEC_PASSWORD)
+            self._token = token["access_token"]
+            # Renew a minute early so a token never expires halfway through a charger.
+            self._token_expires_at = time.monotonic() + float(token.get("expires_in", 3600)) - 60
+        return self._token
+
+    def _wait_until(self, moment: datetime) -> bool:
+        """Sleep until `moment`; returns False if the scheduler was stopped meanwhile."""
+        delay = (moment - datetime.now(timezone.utc)).total_seconds()
+        return not self._stop.wait(max(delay, 0))
+
+    def _record_sync(self, charger_id: str, history_from: datetime, sync_started: datetime):
+        covered = self._charger_coverage.get(charger_id)
+        if covered and history_from <= covered[1]:
+            # The new window overlaps the known span, so it extends it without leaving a gap.
+            self._charger_coverage[charger_id] = (min(covered[0], history_from), sync_started)
+        else:
+            # First sync, or an outage longer than the history window: coverage restarts here.
+            self._charger_coverage[charger_id] = (history_from, sync_started)
+
+    def _run(self):
+        # Start with a random offset so that several instances do not hit Zaptec in lockstep.
+        next_cycle = datetime.now(timezone.utc) + timedelta(seconds=random.uniform(0, SYNC_JITTER_SECONDS))
+        while not self._stop.is_set():
+            self._update(next_cycle_at=next_cycle)
+            if not self._wait_until(next_cycle):
+                break
+
+            cycle_started = datetime.now(timezone.utc)
+            try:
+                chargers = self._run_cycle(cycle_started)
+                if chargers is not None and AUTO_INVOICE:
+                    self._run_month_end_job(cycle_started, chargers)
+            except Exception as exc:
+                logger.exception("Scheduled sync failed")
+                self._update(last_error=f"{type(exc).__name__}: {exc}")
+
+            next_cycle = cycle_started + timedelta(
+                minutes=SYNC_INTERVAL_MINUTES,
+                seconds=random.uniform(-SYNC_JITTER_SECONDS, SYNC_JITTER_SECONDS),
+            )
+            next_cycle = max(next_cycle, datetime.now(timezone.utc))
+
+    def _run_cycle(self, cycle_started: datetime) -> list[dict] | None:
+        """Sync every charger once; returns the chargers seen, or None if stopped midway.
+
+        A failing charger is recorded in `failed_chargers` and does not stop the others.
+        """
+        access_token = self._access_token()
+        chargers = [charger for charger in fetch_chargers(access_token) if _charger_id(charger)]
+        history_from = cycle_started - timedelta(days=SYNC_HISTORY_DAYS)
+        # Leave room for the jitter so the last charger still lands inside the interval.
+        spread_seconds = max(SYNC_INTERVAL_MINUTES * 60 - 2 * SYNC_JITTER_SECONDS, 0)
+        slot_seconds = spread_seconds / len(chargers) if chargers else 0
+
+        self._update(
+            current_cycle_started_at=cycle_started,
+            chargers_total=len(chargers),
+            chargers_synced=0,
+            failed_chargers=[],
+            last_error=None,
+        )
+
+        inserted_total = 0
+        owners_created_total = 0
+        failed_chargers = []
+        for index, charger in enumerate(chargers):
+            slot_start = cycle_started + timedelta(seconds=index * slot_seconds)
+            self._update(next_charger_at=slot_start)
+            if not self._wait_until(slot_start):
+                return None
+
+            charger_id = _charger_id(charger)
+            sync_started = datetime.now(timezone.utc)
+            try:
+                inserted, owners_created = self._sync_charger(self._access_token(), charger, history_from)
+            except Exception as exc:
+                logger.exception("Scheduled sync of charger %s failed", charger_id)
+                failed_chargers.append({"charger_id": charger_id, "error": f"{type(exc).__name__}: {exc}"})
+                self._update(failed_chargers=list(failed_chargers))
+                continue
+
+            self._record_sync(charger_id, history_from, sync_started)
+            inserted_total += inserted
+            owners_created_total += owners_created
+            self._update(chargers_synced=index + 1 - len(failed_chargers))
+
+        self._update(
+            current_cycle_started_at=None,
+            next_charger_at=None,
+            last_cycle_started_at=cycle_started,
+            last_cycle_finished_at=datetime.now(timezone.utc),
+            last_cycle_inserted=inserted_total,
+            last_cycle_owners_created=owners_created_total,
+        )
+        return chargers
+
+    def _uncovered(self, chargers: list[dict], period_start: datetime, cutoff: datetime) -> list[dict]:
+        uncovered = []
+        for charger in chargers:
+            covered = self._charger_coverage.get(_charger_id(charger))
+            if not covered or covered[0] > period_start or covered[1] < cutoff:
+                uncovered.append(charger)
+        return uncovered
+
+    def _run_month_end_job(self, cycle_started: datetime, chargers: list[dict]):
+        # Completeness rule: the previous month is complete once, for every charger in the fleet, this
+        # scheduler has fetched an unbroken span of history from the first day of that month up to a
+        # sync that started at least INVOICE_GRACE_HOURS after the month ended (Zaptec reports some
+        # sessions late). A charger without that span, e.g. because the scheduler was started mid-month
+        # or was down for longer than SCHEDULER_HISTORY_DAYS, gets a catch-up sync from the period start
+        # first; one that still fails only delays invoicing until a later cycle.
+        month_end = _month_start(cycle_started.date())
+        cutoff = month_end + timedelta(hours=INVOICE_GRACE_HOURS)
+        if cycle_started < cutoff:
+            return
+
+        period_start = _previous_month_start(cycle_started.date())
+        target_month = period_start.strftime("%Y-%m")
+        if self.state()["last_invoiced_month"] == target_month or _month_invoiced(period_start):
+            self._update(last_invoiced_month=target_month, month_end_waiting_for=[])
+            return
+
+        history_from = _month_start(period_start)
+        for charger in self._uncovered(chargers, history_from, cutoff):
+            if self._stop.is_set():
+                return
+            charger_id = _charger_id(charger)
+            sync_started = datetime.now(timezone.utc)
+            logger.info("Catch-up sync of charger %s from %s for %s", charger_id, history_from.date(), target_month)
+            try:
+                self._sync_charger(self._access_token(), charger, history_from)
+            except Exception:
+                logger.exception("Catch-up sync of charger %s failed", charger_id)
+                continue
+            self._record_sync(charger_id, history_from, sync_started)
+
+        waiting_for = [_charger_id(charger) for charger in self._uncovered(chargers, history_from, cutoff)]
+        self._update(month_end_waiting_for=waiting_for)
+        if waiting_for:
+            logger.info("Month-end invoice job for %s waits for chargers %s", target_month, ", ".join(waiting_for))
+            return
+
+        logger.info("Running month-end invoice job for %s", target_month)
+        self._generate_invoices(target_month=target_month)
+        self._update(last_invoiced_month=target_month)
@@ -0,0 +1,121 @@
+"""Compare invoice PDF engines on latency and peak memory.
+
+Usage:
+  cd backend
+  python scripts/benchmark_pdf_engines.py --counts 1 10 100 1000 --rows 30
+
+Each engine/count pair runs in a fresh subprocess so that peak RSS reflects only that run,
+including memory held by native libraries (Pango/Cairo for WeasyPrint) that tracemalloc cannot see.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def sample_invoice(index, rows):
+    owner = SimpleNamespace(
+        name=f"Owner {index}",
+        address="Exempelgatan 1\n254 54 Helsingborg",
+        charger_id=f"ZAP{index:06d}",
+    )
+    period_start = date(2026, 1, 1)
+    consumptions = [
+        SimpleNamespace(
+            period_start=period_start + timedelta(days=day % 31),
+            period_end=period_start + timedelta(days=day % 31),
+            kwh_used=7.5 + day,
+            cost_per_kwh=2.0,
+            total_cost=(7.5 + day) * 2.0,
+        )
+        for day in range(rows)
+    ]
+    total_amount = sum(item.total_cost for item in consumptions)
+    return owner, consumptions, total_amount, period_start, date(2026, 1, 31)
+
+
+def run_worker(engine, count, rows):
+    from pdf_generator import PDF_ENGINES, generate_invoice_pdf
+
+    if engine not in PDF_ENGINES:
+        raise SystemExit(f"Unknown engine {engine}")
+
+    invoices = [sample_invoice(index, rows) for index in range(count)]
+    with tempfile.TemporaryDirectory() as output_dir:
+        # Render once before measuring so one-off import and font loading cost is not counted per invoice.
+        owner, consumptions, total_amount, period_start, period_end = invoices[0]
+        generate_invoice_pdf(
+            owner, consumptions, total_amount, os.path.join(output_dir, "warmup.pdf"), period_start, period_end, engine
+        )
+        baseline_mb = peak_rss_mb()
+
+        latencies = []
+        started = time.perf_counter()
+        for index, (owner, consumptions, total_amount, period_start, period_end) in enumerate(invoices):
+            invoice_started = time.perf_counter()
+            output_path = os.path.join(output_dir, f"{index}.pdf")
+            generate_invoice_pdf(owner, consumptions, total_amount, output_path, period_start, period_end, engine)
+            latencies.append(time.perf_counter() - invoice_started)
+        total_seconds = time.perf_counter() - started
+
+    latencies.sort()
+    print(json.dumps({
+        "engine": engine,
+        "count": count,
+        "total_s": total_seconds,
+        "mean_ms": 1000 * total_seconds / count,
+        "p95_ms": 1000 * latencies[min(int(0.95 * count), count - 1)],
+        "peak_rss_mb": peak_rss_mb(),
+        "baseline_rss_mb": baseline_mb,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engines", nargs="+", default=["weasyprint", "reportlab"])
+    parser.add_argument("--counts", nargs="+", type=int, default=[1, 10, 100, 1000])
+    parser.add_argument("--rows", type=int, default=30, help="Charging rows per invoice")
+    parser.add_argument("--worker", nargs=2, metavar=("ENGINE", "COUNT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker[0], int(args.worker[1]), args.rows)
+        return
+
+    print(f"{'engine':<12}{'invoices':>10}{'total s':>10}{'mean ms':>10}{'p95 ms':>10}{'peak MB':>10}{'base MB':>10}")
+    for engine in args.engines:
+        for count in args.counts:
+            completed = subprocess.run(
+                [sys.executable, __file__, "--worker", engine, str(count), "--rows", str(args.rows)],
+                capture_output=True,
+                text=True,
+            )
+            if completed.returncode != 0:
+                # e.g. WeasyPrint without the Pango system libraries; report it instead of aborting the table.
+                error = (completed.stderr.strip().splitlines() or ["failed"])[-1]
+                print(f"{engine:<12}{count:>10}  not measured: {error}")
+                break
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            print(
+                f"{engine:<12}{count:>10}{result['total_s']:>10.2f}{result['mean_ms']:>10.1f}"
+                f"{result['p95_ms']:>10.1f}{result['peak_rss_mb']:>10.1f}{result['baseline_rss_mb']:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,39 @@
 import os
+import threading
+import time
 from datetime import datetime, timedelta, timezone
 
 import requests
 
 ZAPTEC_BASE_URL = os.getenv("ZAPTEC_BASE_URL", "https://api.zaptec.com")
 TOKEN_URL = os.getenv("ZAPTEC_TOKEN_URL", f"{ZAPTEC_BASE_URL}/oauth/token")
+REQUESTS_PER_MINUTE = float(os.getenv("ZAPTEC_REQUESTS_PER_MINUTE", "60"))
+
+
+class RateLimiter:
+    """Spaces calls evenly so that no more than `requests_per_minute` are made, across all threads."""
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            slot = max(time.monotonic(), self._next_slot)
+            self._next_slot = slot + self.interval
+        wait = slot - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+
+rate_limiter = RateLimiter(REQUESTS_PER_MINUTE)
 
 
 def _api_get(path, access_token, params=None):
+    rate_limiter.acquire()
 #    headers = {"Authorization": f"Bearer {access_token}"}
     headers = {"accept": "text/plain","authorization": f"Bearer {access_token}"}
 #    response = requests.post(f"{ZAPTEC_BASE_URL}{path}", headers=headers, params=params, timeout=30)